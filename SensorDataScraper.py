@@ -1,8 +1,12 @@
-import json
-import time
+import asyncio
+import contextlib
 import threading
-import pandas as pd
-from fastapi import FastAPI, HTTPException
+import time
+import aiofiles
+import httpx
+import orjson
+import xxhash
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -11,14 +15,39 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
+from selectolax.parser import HTMLParser
 from typing import Dict, List, Any
 import logging
 import os
+import pathlib
 
 # Set all internal file reads/writes to be relative to this script
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SENSOR_DATA_FILE = os.path.join(BASE_DIR, "sensor_data.json")
-CSV_FILE_PATH = os.path.join(BASE_DIR, "sensor_data.csv")
+BASE_DIR = pathlib.Path(__file__).resolve().parent
+SENSOR_DATA_FILE = BASE_DIR / "sensor_data.json"
+
+SENSOR_NETWORKS_URL = "https://app.iriseup.ph/sensor_networks"
+# Fall back to headless Chromium when the plain HTTP fetch fails (network error, non-2xx
+# status such as a bot-protection 403) or its response has no table rows (e.g. the table
+# is rendered client-side). Set SELENIUM_FALLBACK=0 to disable.
+SELENIUM_FALLBACK = os.getenv("SELENIUM_FALLBACK", "1").lower() not in ("0", "false", "no")
+
+# Validators from the last upstream response, sent back as a conditional request
+_UPSTREAM = {"etag": None, "last_modified": None}
+
+# Long-lived HTTP/2 client and Chrome session, reused across scrape cycles
+_client = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    follow_redirects=True,
+    headers={"User-Agent": "Mozilla/5.0 (compatible; FloodDataScraper/1.0)"},
+)
+_driver = None
+_driver_scrapes = 0
+# Serializes use of _driver between the scraper's worker thread and shutdown; reentrant
+# because a scrape closes the session itself on failure
+_driver_lock = threading.RLock()
+# Restart Chrome after this many scrapes to bound memory growth in the long-lived session
+DRIVER_RESTART_EVERY = 100
 
 # Configure logging
 logging.basicConfig(
@@ -30,13 +59,10 @@ logger = logging.getLogger(__name__)
 # FastAPI Web App
 app = FastAPI(title="Flood Data Scraper API")
 
-# Ensure sensor_data.json exists on startup
-try:
-    if not os.path.exists(SENSOR_DATA_FILE):
-        print("Sensor data file not found, running initial scrape...")
-        scrape_sensor_data()
-except Exception as e:
-    print(f"Error running initial data scrape: {e}")
+# Parsed sensor payload served by the API, with its serialized body and ETag;
+# refreshed on the event loop after each scrape
+_CACHE = {"data": None, "body": None, "etag": None}
+_CACHE_LOCK = asyncio.Lock()
 
 # Configure CORS
 app.add_middleware(
@@ -76,33 +102,23 @@ def setup_chrome_driver():
     try:
         chrome_options = Options()
         chrome_options.binary_location = "/usr/bin/chromium"
-        chrome_options.add_argument("--headless")
         chrome_options.add_argument("--headless=new")  # Use new headless mode
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-dev-shm-usage")
         chrome_options.add_argument("--disable-gpu")
         chrome_options.add_argument("--window-size=1920,1080")
         chrome_options.add_argument("--disable-extensions")
-        chrome_options.add_argument("--disable-software-rasterizer")
-        chrome_options.add_argument("--disable-features=VizDisplayCompositor")
-        chrome_options.add_argument("--disable-features=IsolateOrigins,site-per-process")
-        chrome_options.add_argument("--disable-features=NetworkService")
-        chrome_options.add_argument("--disable-features=NetworkServiceInProcess")
-        chrome_options.add_argument("--disable-features=NetworkServiceInProcess2")
-        chrome_options.add_argument("--disable-gpu-sandbox")
-        chrome_options.add_argument("--disable-accelerated-2d-canvas")
-        chrome_options.add_argument("--disable-accelerated-jpeg-decoding")
-        chrome_options.add_argument("--disable-accelerated-mjpeg-decode")
-        chrome_options.add_argument("--disable-accelerated-video-decode")
-        chrome_options.add_argument("--disable-accelerated-video-encode")
-        chrome_options.add_argument("--disable-webgl")
-        chrome_options.add_argument("--disable-webgl2")
-        chrome_options.add_argument("--disable-3d-apis")
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        # Don't wait for subresources; wait_for_page_load waits explicitly for the table
+        chrome_options.page_load_strategy = "eager"
+        chrome_options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "permissions.default.stylesheet": 2,
+        })
         # Initialize ChromeDriver
         service = Service("/usr/bin/chromedriver")
         driver = webdriver.Chrome(service=service, options=chrome_options)
         driver.set_page_load_timeout(60)
-        driver.implicitly_wait(30)
         return driver
     except Exception as e:
         logger.error(f"Failed to initialize Chrome WebDriver: {str(e)}")
@@ -114,7 +130,7 @@ def wait_for_page_load(driver, url, max_retries=3):
         try:
             logger.info(f"Attempt {attempt + 1} to load page: {url}")
             driver.get(url)
-            WebDriverWait(driver, 60).until(
+            WebDriverWait(driver, 15).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, "table tbody tr"))
             )
             return True
@@ -125,128 +141,230 @@ def wait_for_page_load(driver, url, max_retries=3):
             time.sleep(5)
     return False
 
-def scrape_sensor_data():
-    driver = None
+def extract_sensor_records(rows):
+    """Build sensor records from table rows given as lists of cell texts"""
+    sensor_data = []
+    for cols in rows:
+        if len(cols) >= 5:
+            sensor_data.append({
+                "SENSOR NAME": cols[0],
+                "OBS TIME": cols[1],
+                "NORMAL LEVEL": cols[2],
+                "CURRENT": cols[3],
+                "DESCRIPTION": cols[4]
+            })
+    return sensor_data
+
+def parse_sensor_table(html):
+    """Parse the rows of the sensor table into lists of cell texts"""
+    tree = HTMLParser(html)
+    return [
+        [" ".join(td.text().split()) for td in tr.css("td")]
+        for tr in tree.css("table tbody tr")
+    ]
+
+async def fetch_sensor_rows_http(url):
+    """Fetch the sensor table with a plain HTTP request and parse it with selectolax.
+
+    Returns the parsed rows and the response's validators; rows is None when the
+    upstream answers 304 Not Modified. The caller decides whether to keep the validators.
+    """
+    headers = {}
+    if _UPSTREAM["etag"]:
+        headers["If-None-Match"] = _UPSTREAM["etag"]
+    if _UPSTREAM["last_modified"]:
+        headers["If-Modified-Since"] = _UPSTREAM["last_modified"]
+    response = await _client.get(url, headers=headers)
+    if response.status_code == 304:
+        return None, None
+    response.raise_for_status()
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return parse_sensor_table(response.text), validators
+
+def get_chrome_driver():
+    """Return the shared Chrome session, starting it on first use and every DRIVER_RESTART_EVERY scrapes"""
+    global _driver, _driver_scrapes
+    with _driver_lock:
+        if _driver is not None and _driver_scrapes >= DRIVER_RESTART_EVERY:
+            logger.info(f"Restarting Chrome WebDriver after {_driver_scrapes} scrapes...")
+            close_chrome_driver()
+        if _driver is None:
+            logger.info("Initializing Chrome WebDriver...")
+            _driver = setup_chrome_driver()
+            _driver_scrapes = 0
+        _driver_scrapes += 1
+        return _driver
+
+def close_chrome_driver():
+    global _driver
+    with _driver_lock:
+        if _driver:
+            try:
+                _driver.quit()
+            except Exception as e:
+                logger.error(f"Error closing WebDriver: {str(e)}")
+            _driver = None
+
+def fetch_sensor_rows_selenium(url):
+    """Render the sensor table in headless Chromium and read its rows"""
+    # Hold the lock for the whole scrape so shutdown can't quit the session mid-use
+    with _driver_lock:
+        driver = get_chrome_driver()
+        try:
+            if not wait_for_page_load(driver, url):
+                raise TimeoutError("Failed to load page after multiple attempts")
+            # Fetch the rendered DOM once and parse it locally instead of querying elements over WebDriver
+            return parse_sensor_table(driver.page_source)
+        except Exception:
+            # Drop a session that failed mid-scrape so the next cycle starts a fresh one
+            close_chrome_driver()
+            raise
+
+async def scrape_sensor_data_async():
     try:
-        logger.info("Initializing Chrome WebDriver...")
-        driver = setup_chrome_driver()
-        url = "https://app.iriseup.ph/sensor_networks"
+        url = SENSOR_NETWORKS_URL
         logger.info(f"🌍 Fetching data from: {url}")
-        if not wait_for_page_load(driver, url):
-            raise TimeoutError("Failed to load page after multiple attempts")
-
-        sensor_data = []
-        rows = driver.find_elements(By.CSS_SELECTOR, "table tbody tr")
-        for row in rows:
-            cols = row.find_elements(By.TAG_NAME, "td")
-            if len(cols) >= 5:
-                sensor_name = cols[0].text.strip()
-                location = cols[1].text.strip()
-                current_level = cols[3].text.strip()
-                normal_level = cols[2].text.strip()
-                description = cols[4].text.strip() if len(cols) > 4 else "N/A"
-                sensor_data.append({
-                    "SENSOR NAME": sensor_name,
-                    "OBS TIME": location,
-                    "NORMAL LEVEL": normal_level,
-                    "CURRENT": current_level,
-                    "DESCRIPTION": description
-                })
+        try:
+            rows, validators = await fetch_sensor_rows_http(url)
+        except httpx.HTTPError as e:
+            if not SELENIUM_FALLBACK:
+                raise
+            logger.warning(f"HTTP fetch failed: {str(e)}")
+            rows, validators = [], None
+        if rows is None:
+            logger.info("✅ Upstream data not modified, skipping update")
+            return
+        sensor_data = extract_sensor_records(rows)
+        # Only trust the validators when the HTML itself carries the records; a client-side
+        # rendered shell can stay unchanged while the data behind it moves on
+        if not sensor_data:
+            validators = {"etag": None, "last_modified": None}
+        if not sensor_data and SELENIUM_FALLBACK:
+            logger.warning("No sensor records over HTTP, falling back to Selenium...")
+            rows = await asyncio.to_thread(fetch_sensor_rows_selenium, url)
+            sensor_data = extract_sensor_records(rows)
 
         if not sensor_data:
             raise ValueError("No sensor data extracted. Check website structure.")
         logger.info(f"✅ Successfully scraped {len(sensor_data)} sensor records")
-        save_csv(sensor_data)
-        convert_csv_to_json()
+        categorized_data = build_categorized(sensor_data)
+        await asyncio.to_thread(save_json, categorized_data)
+        update_sensor_data_cache(categorized_data)
+        # Commit the validators only once the cycle has been written and cached
+        _UPSTREAM.update(validators)
         logger.info("✅ Sensor data updated successfully")
     except Exception as e:
         logger.error(f"❌ Scraping Failed: {str(e)}")
         raise
-    finally:
-        if driver:
-            try:
-                driver.quit()
-            except Exception as e:
-                logger.error(f"Error closing WebDriver: {str(e)}")
-
-def save_csv(sensor_data):
-    df = pd.DataFrame(sensor_data)
-    df.to_csv(CSV_FILE_PATH, index=False)
-    print("✅ CSV file saved successfully with all sensor data.")
 
-def convert_csv_to_json():
-    df = pd.read_csv(CSV_FILE_PATH)
+def build_categorized(sensor_data: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Group the scraped sensor records into the categories served by the API in a single pass"""
+    # All records per casefolded name, in scrape order; a name can appear in several table sections
+    by_name = {}
+    for row in sensor_data:
+        by_name.setdefault(row["SENSOR NAME"].casefold(), []).append(row)
     categorized_data = {category: [] for category in SENSOR_CATEGORIES}
-    for _, row in df.iterrows():
-        sensor_name = row["SENSOR NAME"]
-        current_value = row["CURRENT"]
-        normal_value = row["NORMAL LEVEL"] if "NORMAL LEVEL" in df.columns else "N/A"
-        description = row["DESCRIPTION"] if "DESCRIPTION" in df.columns else "N/A"
-        sensor_entry = {
-            "SENSOR NAME": sensor_name,
-            "CURRENT": current_value,
-        }
-        if "m" in str(current_value):
-            category = "street_flood_sensors"
-            sensor_entry["NORMAL LEVEL"] = normal_value
-            sensor_entry["DESCRIPTION"] = description
-        else:
-            category = "flood_risk_index"
-        if sensor_name in SENSOR_CATEGORIES[category]:
-            categorized_data[category].append(sensor_entry)
     for category, sensors in SENSOR_CATEGORIES.items():
-        if category not in ["street_flood_sensors", "flood_risk_index"]:
-            for sensor_name in sensors:
-                matching_sensor = df[df["SENSOR NAME"].str.casefold() == sensor_name.casefold()]
-                if not matching_sensor.empty:
-                    normal_value = matching_sensor.iloc[0]["NORMAL LEVEL"] if "NORMAL LEVEL" in df.columns else "N/A"
-                    current_value = matching_sensor.iloc[0]["CURRENT"]
-                    description = matching_sensor.iloc[0]["DESCRIPTION"] if "DESCRIPTION" in df.columns else "N/A"
-                    sensor_entry = {
-                        "SENSOR NAME": sensor_name,
-                        "CURRENT": current_value,
-                    }
-                    if category in ["flood_sensors"]:
-                        sensor_entry["NORMAL LEVEL"] = normal_value
-                        sensor_entry["DESCRIPTION"] = description
-                    categorized_data[category].append(sensor_entry)
-                else:
-                    sensor_entry = {
-                        "SENSOR NAME": sensor_name,
-                        "CURRENT": "0.0m" if category == "street_flood_sensors" else 0.0,
-                    }
-                    if category in ["flood_sensors"]:
-                        sensor_entry["NORMAL LEVEL"] = "N/A"
-                        sensor_entry["DESCRIPTION"] = "N/A"
-                    categorized_data[category].append(sensor_entry)
-    with open(SENSOR_DATA_FILE, "w") as f:
-        json.dump(categorized_data, f, indent=4)
+        for sensor_name in sensors:
+            rows = by_name.get(sensor_name.casefold(), [])
+            # Readings with a unit ("0.0 m") are street flood levels, the rest are risk indices
+            if category == "street_flood_sensors":
+                rows = [row for row in rows if "m" in row["CURRENT"]]
+            elif category == "flood_risk_index":
+                rows = [row for row in rows if "m" not in row["CURRENT"]]
+            else:
+                rows = rows[:1]
+            # Street flood and risk index sensors missing upstream are left out rather than
+            # padded with a reading that would look like zero water
+            if not rows and category not in ["street_flood_sensors", "flood_risk_index"]:
+                rows = [{"CURRENT": 0.0}]
+            for row in rows:
+                sensor_entry = {
+                    "SENSOR NAME": sensor_name,
+                    "CURRENT": row["CURRENT"],
+                }
+                if category in ["flood_sensors", "street_flood_sensors"]:
+                    sensor_entry["NORMAL LEVEL"] = row.get("NORMAL LEVEL", "N/A")
+                    sensor_entry["DESCRIPTION"] = row.get("DESCRIPTION", "N/A")
+                categorized_data[category].append(sensor_entry)
+    return categorized_data
+
+def save_json(categorized_data):
+    # Write to a temp file and rename over the original so readers never see partial JSON
+    tmp_file = SENSOR_DATA_FILE.with_name(SENSOR_DATA_FILE.name + ".tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(orjson.dumps(categorized_data, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_file, SENSOR_DATA_FILE)
     print("✅ JSON data structured correctly with Street Flood Sensor Check.")
 
-@app.get("/api/sensor-data", response_model=Dict[str, List[Dict[str, Any]]])
-async def get_sensor_data():
+def update_sensor_data_cache(data):
+    """Cache the payload together with its serialized body and ETag, computed once per scrape"""
+    body = orjson.dumps(data)
+    etag = f'"{xxhash.xxh3_64_hexdigest(body)}"'
+    _CACHE.update(data=data, body=body, etag=etag)
+
+async def load_sensor_data_file():
+    """Read SENSOR_DATA_FILE without blocking the event loop and cache the parsed payload"""
+    async with _CACHE_LOCK:
+        if _CACHE["data"] is None:
+            async with aiofiles.open(SENSOR_DATA_FILE, "rb") as f:
+                data = orjson.loads(await f.read())
+            update_sensor_data_cache(data)
+    return _CACHE["data"]
+
+@app.on_event("startup")
+async def prime_sensor_data_cache():
+    # The background scraper performs the first scrape, so only load what is already on disk
     try:
-        with open(SENSOR_DATA_FILE, "r") as f:
-            data = json.load(f)
-        return data
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Return a minimal fallback structure, not a 404, so frontend can work (even if data is empty)
-        print("Warning: sensor_data.json not found or invalid, returning empty data.")
-        return {key: [] for key in SENSOR_CATEGORIES.keys()}
-
-def start_auto_scraper():
+        await load_sensor_data_file()
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        print("Sensor data file not found or invalid, waiting for the first scrape...")
+
+@app.get("/api/sensor-data", response_model=Dict[str, List[Dict[str, Any]]])
+async def get_sensor_data(request: Request):
+    if _CACHE["data"] is None:
+        try:
+            await load_sensor_data_file()
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            # Return a minimal fallback structure, not a 404, so frontend can work (even if data is empty)
+            print("Warning: sensor_data.json not found or invalid, returning empty data.")
+            return {key: [] for key in SENSOR_CATEGORIES.keys()}
+    etag = _CACHE["etag"]
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=30"}
+    # If-None-Match uses weak comparison; proxies that compress the body often add a W/ prefix
+    if_none_match = request.headers.get("if-none-match", "")
+    client_tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in client_tags or etag in client_tags:
+        return Response(status_code=304, headers=headers)
+    return Response(content=_CACHE["body"], media_type="application/json", headers=headers)
+
+async def auto_scrape_loop():
     while True:
         print("🔄 Running data scraper...")
         try:
-            scrape_sensor_data()
+            await scrape_sensor_data_async()
         except Exception as e:
             logger.error(f"Error in background scraper: {e}")
         print("⏳ Waiting 60 seconds before the next scrape...")
-        time.sleep(60)
+        await asyncio.sleep(60)
+
+# Run the background scraper on the event loop alongside the API
+@app.on_event("startup")
+async def start_auto_scraper():
+    app.state.scraper_task = asyncio.create_task(auto_scrape_loop())
 
-# Always start the background scraper thread (recommended for FastAPI deployment)
-scraper_thread = threading.Thread(target=start_auto_scraper, daemon=True)
-scraper_thread.start()
+@app.on_event("shutdown")
+async def stop_auto_scraper():
+    app.state.scraper_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await app.state.scraper_task
+    await _client.aclose()
+    # Cancelling the task doesn't stop a Selenium scrape already running in a worker thread;
+    # close_chrome_driver waits on _driver_lock until that scrape has finished
+    await asyncio.to_thread(close_chrome_driver)
 
 if __name__ == "__main__":
     import uvicorn